@@ -1,39 +1,36 @@
+import asyncio
 import logging
+import queue
 import smtplib
-from typing import List, Optional
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
 from uuid import UUID
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.message import EmailMessage
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 
+from db import SessionLocal, get_db
 from models import (
-    SessionLocal,
     Alert,
     AlertStatus,
     AlertType,
     Incident,
     AuditLog,
 )
-from crud import get_alert, get_alerts, get_incident, get_incidents
+from crud import AlertOut, get_alert, get_alert_with_incident, get_alerts, invalidate_alert, serialize_rows
 
-import requests
+import httpx
 import os
+import uuid
 from datetime import datetime
 
 # Configure logger
 logger = logging.getLogger("alerting")
 logger.setLevel(logging.INFO)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # --- Email Alert Delivery ---
 
 EMAIL_HOST = os.getenv("EMAIL_HOST", "smtp.example.com")
@@ -42,55 +39,242 @@ EMAIL_USER = os.getenv("EMAIL_USER", "alert@example.com")
 EMAIL_PASS = os.getenv("EMAIL_PASS", "password")
 EMAIL_FROM = os.getenv("EMAIL_FROM", "alert@example.com")
 EMAIL_TO = os.getenv("EMAIL_TO", "devops@example.com")  # Comma-separated list
+_DEFAULT_RECIPIENTS = tuple(addr.strip() for addr in EMAIL_TO.split(",") if addr.strip())
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "5"))
+SMTP_MAX_MESSAGES = int(os.getenv("SMTP_MAX_MESSAGES", "100"))  # Rotate a session after this many sends
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))  # seconds, per socket operation
+SMTP_CHECKOUT_TIMEOUT = float(os.getenv("SMTP_CHECKOUT_TIMEOUT", "10"))  # seconds to wait for a free session
+
+class SMTPPoolExhausted(Exception):
+    """
+    Raised when no pooled SMTP session frees up within the checkout timeout.
+    """
+
+class _SMTPPool:
+    """
+    Bounded pool of authenticated SMTP sessions reused across alert deliveries.
+    Sessions are opened lazily, health-checked with NOOP before reuse and
+    rotated after SMTP_MAX_MESSAGES sends to respect per-connection rate limits.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        size: int,
+        max_messages: int,
+        timeout: float = SMTP_TIMEOUT,
+        checkout_timeout: float = SMTP_CHECKOUT_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.checkout_timeout = checkout_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        server.starttls()
+        server.login(EMAIL_USER, EMAIL_PASS)
+        logger.info(f"Opened SMTP session to {self.host}:{self.port}")
+        return server
+
+    @staticmethod
+    def _is_alive(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _discard(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """
+        Checks out a live SMTP session, reconnecting transparently if the pooled one has dropped.
+        Raises SMTPPoolExhausted if no session frees up within `checkout_timeout` seconds.
+        """
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise SMTPPoolExhausted(f"No SMTP session available within {self.checkout_timeout}s")
+        try:
+            try:
+                server, sent = self._idle.get_nowait()
+            except queue.Empty:
+                server, sent = None, 0
+            if server is not None and not self._is_alive(server):
+                self._discard(server)
+                server = None
+            if server is None:
+                server, sent = self._connect(), 0
+            try:
+                yield server
+            except Exception:
+                self._discard(server)
+                raise
+            sent += 1
+            if sent >= self.max_messages:
+                self._discard(server)
+            else:
+                self._idle.put((server, sent))
+        finally:
+            self._slots.release()
+
+    def close_all(self) -> None:
+        """
+        Quits every idle pooled session.
+        """
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(server)
+
+_smtp_pool = _SMTPPool(EMAIL_HOST, EMAIL_PORT, SMTP_POOL_SIZE, SMTP_MAX_MESSAGES)
+
+def close_smtp_pool() -> None:
+    """
+    Closes pooled SMTP sessions (called on application shutdown).
+    """
+    _smtp_pool.close_all()
+    logger.info("SMTP pool closed.")
 
 def send_email_alert(subject: str, body: str, recipients: Optional[List[str]] = None) -> bool:
     """
-    Sends an email alert using SMTP.
+    Sends an email alert using a pooled SMTP session.
     """
-    recipients = recipients or EMAIL_TO.split(",")
-    msg = MIMEMultipart()
+    recipients = list(recipients) if recipients else list(_DEFAULT_RECIPIENTS)
+    msg = EmailMessage()
     msg["From"] = EMAIL_FROM
     msg["To"] = ", ".join(recipients)
     msg["Subject"] = subject
-    msg.attach(MIMEText(body, "plain"))
+    msg.set_content(body)
 
     try:
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.sendmail(EMAIL_FROM, recipients, msg.as_string())
+        with _smtp_pool.connection() as server:
+            server.send_message(msg, from_addr=EMAIL_FROM, to_addrs=recipients)
         logger.info(f"Email alert sent to {recipients}: {subject}")
         return True
+    except SMTPPoolExhausted as e:
+        logger.error(f"Email alert not sent, SMTP pool exhausted: {e}")
+        return False
     except Exception as e:
         logger.error(f"Failed to send email alert: {e}")
         return False
 
+# Per-event-loop cap on in-flight email sends, so senders beyond the SMTP pool size
+# wait on the loop instead of parking default-executor threads inside connection()
+_email_slots: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+async def send_email_alert_async(subject: str, body: str) -> bool:
+    """
+    Runs send_email_alert in a worker thread, at most SMTP_POOL_SIZE at a time.
+    """
+    global _email_slots
+    loop = asyncio.get_running_loop()
+    if _email_slots is None or _email_slots[0] is not loop:
+        _email_slots = (loop, asyncio.Semaphore(SMTP_POOL_SIZE))
+    async with _email_slots[1]:
+        return await asyncio.to_thread(send_email_alert, subject, body)
+
 # --- Slack Alert Delivery ---
 
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL", "")
+SLACK_MAX_ATTEMPTS = 3
+SLACK_RETRY_BACKOFF = 0.5  # seconds, doubled after each failed attempt
+
+# Shared keep-alive client so webhook deliveries don't pay TCP+TLS setup per alert
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the shared async HTTP client, creating it on first use.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+            timeout=5,
+        )
+    return _http_client
 
-def send_slack_alert(message: str) -> bool:
+async def close_http_client() -> None:
+    """
+    Closes the shared async HTTP client (called on application shutdown).
     """
-    Sends an alert message to Slack via webhook.
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("HTTP client closed.")
+
+async def send_slack_alert(message: str) -> bool:
+    """
+    Sends an alert message to Slack via webhook, retrying transient failures with exponential backoff.
     """
     if not SLACK_WEBHOOK_URL:
         logger.warning("Slack webhook URL not configured.")
         return False
     payload = {"text": message}
-    try:
-        response = requests.post(SLACK_WEBHOOK_URL, json=payload, timeout=5)
-        if response.status_code == 200:
-            logger.info("Slack alert sent successfully.")
-            return True
-        else:
+    for attempt in range(1, SLACK_MAX_ATTEMPTS + 1):
+        try:
+            response = await get_http_client().post(SLACK_WEBHOOK_URL, json=payload)
+            if response.status_code == 200:
+                logger.info("Slack alert sent successfully.")
+                return True
             logger.error(f"Slack alert failed: {response.status_code} {response.text}")
-            return False
-    except Exception as e:
-        logger.error(f"Failed to send Slack alert: {e}")
-        return False
+            if response.status_code < 500 and response.status_code != 429:
+                return False
+        except Exception as e:
+            logger.error(f"Failed to send Slack alert (attempt {attempt}/{SLACK_MAX_ATTEMPTS}): {e}")
+        if attempt < SLACK_MAX_ATTEMPTS:
+            await asyncio.sleep(SLACK_RETRY_BACKOFF * 2 ** (attempt - 1))
+    return False
 
 # --- Alert Generation & Logging ---
 
+ALERT_CONCURRENCY = int(os.getenv("ALERT_CONCURRENCY", "16"))  # Max in-flight deliveries per burst
+
+# Message templates, built once at import and filled per alert
+_SUBJECT_TMPL = "[{severity_upper}] Alert: {title}"
+_BODY_TMPL = (
+    "Alert Type: {type}\n"
+    "Resource ID: {resource_id}\n"
+    "Triggered At: {triggered_at}\n"
+    "Severity: {severity}\n"
+    "Description: {description}\n"
+    "Details: {details}\n"
+)
+_SLACK_TMPL = "*{subject}*\n{body}"
+
+def audit_event_fields(
+    alert: Alert,
+    event_type: str,
+    actor: Optional[str] = "system",
+    details: Optional[dict] = None,
+    incident: Optional[Incident] = None,
+    event_time: Optional[datetime] = None,
+) -> dict:
+    """
+    Builds the column values for an audit log row describing an alert event.
+    `event_time` defaults to the current time.
+    """
+    return {
+        "incident_id": incident.id if incident else alert.incident_id,
+        "alert_id": alert.id,
+        "event_type": event_type,
+        "event_time": event_time or datetime.utcnow(),
+        "actor": actor,
+        "details": details or {},
+    }
+
 def log_alert_event(
     db: Session,
     alert: Alert,
@@ -102,50 +286,115 @@ def log_alert_event(
     """
     Logs an alert event to the immutable audit log.
     """
-    audit_log = AuditLog(
-        incident_id=incident.id if incident else alert.incident_id,
-        alert_id=alert.id,
-        event_type=event_type,
-        event_time=datetime.utcnow(),
-        actor=actor,
-        details=details or {},
-    )
+    audit_log = AuditLog(**audit_event_fields(alert, event_type, actor, details, incident))
     db.add(audit_log)
     db.commit()
-    db.refresh(audit_log)
     logger.info(f"Audit log event recorded: {event_type} for alert {alert.id}")
     return audit_log
 
-def deliver_alert(db: Session, alert: Alert, incident: Optional[Incident] = None) -> bool:
-    """
-    Delivers an alert via configured channels and logs the event.
+def log_alert_events_bulk(db: Session, events: List[dict]) -> int:
     """
-    subject = f"[{alert.severity.upper()}] Alert: {alert.title}"
-    body = f"""
-    Alert Type: {alert.type}
-    Resource ID: {alert.resource_id}
-    Triggered At: {alert.triggered_at}
-    Severity: {alert.severity}
-    Description: {alert.description}
-    Details: {alert.details}
+    Writes many audit log events in a single INSERT batch and one commit.
+    Primary keys are generated client-side so no RETURNING/refresh round-trip is needed.
     """
-    slack_message = f"*{subject}*\n{body}"
+    if not events:
+        return 0
+    audit_logs = [AuditLog(**{"id": uuid.uuid4(), **event}) for event in events]
+    db.bulk_save_objects(audit_logs, return_defaults=False)
+    db.commit()
+    logger.info(f"Audit log events recorded in bulk: {len(audit_logs)}")
+    return len(audit_logs)
 
-    email_sent = send_email_alert(subject, body)
-    slack_sent = send_slack_alert(slack_message)
+async def deliver_alert(
+    db: Session,
+    alert: Alert,
+    incident: Optional[Incident] = None,
+    audit_events: Optional[List[dict]] = None,
+) -> bool:
+    """
+    Delivers an alert via configured channels concurrently and logs the event.
+    If `audit_events` is given, the audit row is appended to it instead of being written immediately.
+    """
+    fields = {
+        "type": alert.type,
+        "resource_id": alert.resource_id,
+        "triggered_at": alert.triggered_at,
+        "severity": alert.severity,
+        "severity_upper": alert.severity.upper(),
+        "title": alert.title,
+        "description": alert.description,
+        "details": alert.details,
+    }
+    subject = _SUBJECT_TMPL.format_map(fields)
+    body = _BODY_TMPL.format_map(fields)
+    slack_message = _SLACK_TMPL.format(subject=subject, body=body)
 
-    log_alert_event(
-        db=db,
-        alert=alert,
-        event_type="alert_generated",
-        details={
-            "email_sent": email_sent,
-            "slack_sent": slack_sent,
-        },
-        incident=incident,
+    # SMTP is blocking, so run it in a worker thread alongside the Slack webhook
+    email_result, slack_result = await asyncio.gather(
+        send_email_alert_async(subject, body),
+        send_slack_alert(slack_message),
+        return_exceptions=True,
     )
+    for channel, result in (("email", email_result), ("slack", slack_result)):
+        if isinstance(result, BaseException):
+            logger.error(f"Unexpected {channel} delivery error for alert {alert.id}: {result}")
+    email_sent = email_result is True
+    slack_sent = slack_result is True
+
+    details = {
+        "email_sent": email_sent,
+        "slack_sent": slack_sent,
+    }
+    if audit_events is not None:
+        audit_events.append(audit_event_fields(alert, "alert_generated", details=details, incident=incident))
+    else:
+        # Blocking commit; run it in a worker thread so the event loop keeps serving requests
+        await asyncio.to_thread(
+            log_alert_event,
+            db=db,
+            alert=alert,
+            event_type="alert_generated",
+            details=details,
+            incident=incident,
+        )
     return email_sent or slack_sent
 
+async def deliver_alerts_bulk(db: Session, alerts: List[Alert]) -> List[bool]:
+    """
+    Delivers a burst of alerts concurrently (at most ALERT_CONCURRENCY at a time)
+    and records all their audit events in one batched write.
+    """
+    audit_events: List[dict] = []
+    semaphore = asyncio.Semaphore(ALERT_CONCURRENCY)
+
+    async def _deliver(alert: Alert) -> bool:
+        async with semaphore:
+            return await deliver_alert(db, alert, audit_events=audit_events)
+
+    results = await asyncio.gather(*(_deliver(alert) for alert in alerts))
+    await asyncio.to_thread(log_alert_events_bulk, db, audit_events)
+    return list(results)
+
+async def deliver_alert_by_id(alert_id: UUID, session_factory=SessionLocal) -> bool:
+    """
+    Background delivery task: reloads the alert in its own short-lived session
+    (the request's session is closed by then) and delivers it.
+    """
+    db = session_factory()
+    try:
+        try:
+            # Sync session: run the lookup in a worker thread, not on the event loop
+            alert = await asyncio.to_thread(get_alert_with_incident, db, alert_id)
+        except HTTPException:
+            logger.warning(f"Alert {alert_id} disappeared before background delivery.")
+            return False
+        success = await deliver_alert(db, alert, alert.incident)
+        if not success:
+            logger.error(f"Failed to deliver alert {alert_id} via any channel.")
+        return success
+    finally:
+        db.close()
+
 def resolve_alert(db: Session, alert: Alert, actor: Optional[str] = "system") -> Alert:
     """
     Resolves an alert and logs the resolution event.
@@ -153,57 +402,32 @@ def resolve_alert(db: Session, alert: Alert, actor: Optional[str] = "system") ->
     if alert.status == AlertStatus.RESOLVED:
         logger.info(f"Alert already resolved: {alert.id}")
         return alert
-    alert.status = AlertStatus.RESOLVED
+    alert.status = AlertStatus.RESOLVED.value
     alert.resolved_at = datetime.utcnow()
     db.commit()
-    db.refresh(alert)
+    invalidate_alert(alert.id)
     log_alert_event(
         db=db,
         alert=alert,
         event_type="alert_resolved",
         actor=actor,
-        details={"resolved_at": alert.resolved_at},
+        details={"resolved_at": alert.resolved_at.isoformat()},
     )
     logger.info(f"Alert resolved: {alert.id}")
     return alert
 
 # --- FastAPI Router ---
 
-from pydantic import BaseModel, Field
-
-class AlertOut(BaseModel):
-    id: UUID
-    resource_id: Optional[UUID]
-    type: str
-    status: str
-    title: str
-    description: Optional[str]
-    triggered_at: str
-    resolved_at: Optional[str]
-    severity: str
-    details: Optional[dict]
-
-    class Config:
-        orm_mode = True
-
 alerting_router = APIRouter()
 
-@alerting_router.post("/alerts/{alert_id}/deliver", status_code=status.HTTP_200_OK)
-def deliver_alert_endpoint(alert_id: UUID, db: Session = Depends(get_db)):
+@alerting_router.post("/alerts/{alert_id}/deliver", status_code=status.HTTP_202_ACCEPTED)
+def deliver_alert_endpoint(alert_id: UUID, background: BackgroundTasks, db: Session = Depends(get_db)):
     """
-    Deliver an alert via email and Slack, and log the event.
+    Schedule delivery of an alert via email and Slack; the event is logged once delivery completes.
     """
     alert = get_alert(db, alert_id)
-    incident = None
-    if alert.incident_id:
-        incident = get_incident(db, alert.incident_id)
-    success = deliver_alert(db, alert, incident)
-    if not success:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to deliver alert via any channel."
-        )
-    return {"detail": "Alert delivered successfully."}
+    background.add_task(deliver_alert_by_id, alert.id)
+    return {"detail": "Alert delivery scheduled."}
 
 @alerting_router.post("/alerts/{alert_id}/resolve", response_model=AlertOut)
 def resolve_alert_endpoint(alert_id: UUID, actor: Optional[str] = Query("system"), db: Session = Depends(get_db)):
@@ -220,7 +444,8 @@ def list_alerts(skip: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=100
     List all alerts.
     """
     alerts = get_alerts(db, skip=skip, limit=limit)
-    return alerts
+    # Rows come straight from the DB, so bypass response_model re-validation
+    return ORJSONResponse(serialize_rows(alerts, AlertOut))
 
 @alerting_router.get("/alerts/{alert_id}", response_model=AlertOut)
 def get_alert_endpoint(alert_id: UUID, db: Session = Depends(get_db)):
@@ -234,8 +459,17 @@ def get_alert_endpoint(alert_id: UUID, db: Session = Depends(get_db)):
 __all__ = [
     "alerting_router",
     "deliver_alert",
+    "deliver_alerts_bulk",
+    "deliver_alert_by_id",
     "resolve_alert",
     "send_email_alert",
+    "send_email_alert_async",
     "send_slack_alert",
+    "close_smtp_pool",
+    "SMTPPoolExhausted",
+    "get_http_client",
+    "close_http_client",
     "log_alert_event",
+    "log_alert_events_bulk",
+    "audit_event_fields",
 ]
\ No newline at end of file
@@ -1,34 +1,34 @@
 import logging
+from datetime import datetime
 from typing import List, Optional
 from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 
+from db import get_db
 from models import (
-    SessionLocal,
     AuditLog,
     Incident,
     Alert,
 )
-from crud import get_incident, get_alert
+from crud import get_incident, get_alert, get_by_id_cached, serialize_rows
+from cache import TTLCache
 
 # Configure logger
 logger = logging.getLogger("audit_log")
 logger.setLevel(logging.INFO)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # --- Audit Log Query Logic ---
 
+# Audit entries are written once and never updated, so they can be cached for much longer
+# than other rows. The TTL only bounds staleness of incident_id/alert_id, which the
+# database nulls out (ON DELETE SET NULL) when the referenced incident or alert is removed.
+_audit_log_cache = TTLCache(maxsize=8192, ttl=300)
+
 def get_audit_log(db: Session, audit_log_id: UUID) -> AuditLog:
-    audit_log = db.query(AuditLog).filter(AuditLog.id == audit_log_id).first()
+    audit_log = get_by_id_cached(db, _audit_log_cache, AuditLog, audit_log_id)
     if not audit_log:
         logger.warning(f"Audit log not found: {audit_log_id}")
         raise HTTPException(
@@ -60,12 +60,12 @@ class AuditLogOut(BaseModel):
     incident_id: Optional[UUID]
     alert_id: Optional[UUID]
     event_type: str
-    event_time: str
+    event_time: datetime
     actor: Optional[str]
     details: Optional[dict]
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 audit_log_router = APIRouter()
 
@@ -81,7 +81,8 @@ def list_audit_logs(
     List audit log entries, optionally filtered by incident or alert.
     """
     logs = get_audit_logs(db, incident_id=incident_id, alert_id=alert_id, skip=skip, limit=limit)
-    return logs
+    # Rows come straight from the DB, so bypass response_model re-validation
+    return ORJSONResponse(serialize_rows(logs, AuditLogOut))
 
 @audit_log_router.get("/{audit_log_id}", response_model=AuditLogOut)
 def get_audit_log_endpoint(audit_log_id: UUID, db: Session = Depends(get_db)):
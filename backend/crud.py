@@ -1,30 +1,78 @@
+import functools
 import logging
-from typing import List, Optional
+from datetime import datetime
+from typing import List, Optional, Tuple
 from uuid import UUID
 
 from fastapi import APIRouter, HTTPException, status, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, load_only, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 
+from db import get_db
 from models import (
-    SessionLocal,
     Product,
     Resource,
     Alert,
     Incident,
     AuditLog,
 )
+from cache import TTLCache
 
 # Configure logger for CRUD operations
 logger = logging.getLogger("crud")
 logger.setLevel(logging.INFO)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Per-process caches for by-id lookups (entries are detached copies, never session-bound)
+CACHE_MAXSIZE = 4096
+CACHE_TTL_SECONDS = 30
+
+_product_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+_resource_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+_alert_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+_incident_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+
+# -------------------- Cached Lookups --------------------
+
+def _detached_copy(obj):
+    """
+    Builds a detached snapshot of an ORM instance's column state, safe to share across sessions.
+    """
+    mapper = inspect(obj).mapper
+    snapshot = mapper.class_(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+def get_by_id_cached(db: Session, cache: TTLCache, model, obj_id: UUID):
+    """
+    Looks up `model` by primary key, serving repeat lookups from `cache` without a SELECT.
+    """
+    # An instance already in this session wins; merging the snapshot would overwrite pending changes
+    existing = db.identity_map.get(identity_key(model, obj_id))
+    if existing is not None:
+        return existing
+    cached = cache.get(obj_id)
+    if cached is not None:
+        # load=False attaches the snapshot to this session without re-querying the row
+        return db.merge(cached, load=False)
+    # Session.get() checks the identity map first and reuses SQLAlchemy's cached primary-key load
+    obj = db.get(model, obj_id)
+    if obj is not None:
+        cache.set(obj_id, _detached_copy(obj))
+    return obj
+
+def invalidate_alert(alert_id: UUID) -> None:
+    """
+    Drops a cached alert after it has been modified.
+    """
+    _alert_cache.pop(alert_id, None)
+
+def invalidate_incident(incident_id: UUID) -> None:
+    """
+    Drops a cached incident after it has been modified.
+    """
+    _incident_cache.pop(incident_id, None)
 
 # -------------------- Product CRUD Operations --------------------
 
@@ -42,7 +90,6 @@ def create_product(db: Session, name: str, description: Optional[str] = None) ->
     product = Product(name=name, description=description)
     db.add(product)
     db.commit()
-    db.refresh(product)
     logger.info(f"Product created: {product.id} ({product.name})")
     return product
 
@@ -50,7 +97,7 @@ def get_product(db: Session, product_id: UUID) -> Product:
     """
     Retrieve a product by its ID.
     """
-    product = db.query(Product).filter(Product.id == product_id).first()
+    product = get_by_id_cached(db, _product_cache, Product, product_id)
     if not product:
         logger.warning(f"Product not found: {product_id}")
         raise HTTPException(
@@ -70,20 +117,22 @@ def update_product(db: Session, product_id: UUID, name: Optional[str] = None, de
     Update an existing product.
     """
     product = get_product(db, product_id)
-    if name:
-        # Check for name conflict
-        existing = db.query(Product).filter(Product.name == name, Product.id != product_id).first()
-        if existing:
-            logger.warning(f"Attempt to update product to duplicate name: {name}")
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Another product with this name already exists."
-            )
+    if name and name != product.name:
         product.name = name
     if description is not None:
         product.description = description
-    db.commit()
-    db.refresh(product)
+    try:
+        # Name conflicts are caught by the UNIQUE(name) constraint rather than a pre-check SELECT
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        logger.warning(f"Attempt to update product to duplicate name: {name}")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Another product with this name already exists."
+        )
+    finally:
+        _product_cache.pop(product_id, None)
     logger.info(f"Product updated: {product.id} ({product.name})")
     return product
 
@@ -92,14 +141,28 @@ def delete_product(db: Session, product_id: UUID) -> None:
     Delete a product by its ID.
     """
     product = get_product(db, product_id)
+    # Resources, their alerts and incidents go with the product (ON DELETE CASCADE), so
+    # collect their ids first and evict them too; alerts linked to a deleted incident lose
+    # their incident_id (SET NULL) and are evicted as well.
+    resource_ids = [rid for (rid,) in db.query(Resource.id).filter(Resource.product_id == product_id)]
+    incident_ids = [iid for (iid,) in db.query(Incident.id).filter(Incident.resource_id.in_(resource_ids))]
+    alert_ids = [
+        aid for (aid,) in db.query(Alert.id).filter(
+            or_(Alert.resource_id.in_(resource_ids), Alert.incident_id.in_(incident_ids))
+        )
+    ]
     db.delete(product)
     db.commit()
+    _product_cache.pop(product_id, None)
+    for cache, ids in ((_resource_cache, resource_ids), (_incident_cache, incident_ids), (_alert_cache, alert_ids)):
+        for obj_id in ids:
+            cache.pop(obj_id, None)
     logger.info(f"Product deleted: {product.id} ({product.name})")
 
 # -------------------- Resource CRUD Operations --------------------
 
 def get_resource(db: Session, resource_id: UUID) -> Resource:
-    resource = db.query(Resource).filter(Resource.id == resource_id).first()
+    resource = get_by_id_cached(db, _resource_cache, Resource, resource_id)
     if not resource:
         logger.warning(f"Resource not found: {resource_id}")
         raise HTTPException(
@@ -111,10 +174,42 @@ def get_resource(db: Session, resource_id: UUID) -> Resource:
 def get_resources(db: Session, skip: int = 0, limit: int = 100) -> List[Resource]:
     return db.query(Resource).order_by(Resource.created_at.desc()).offset(skip).limit(limit).all()
 
+def get_monitorable_aws_ec2_resources(db: Session, skip: int = 0, limit: int = 100) -> List[Resource]:
+    """
+    Returns monitoring-enabled AWS EC2 resources, filtered in the DB on the normalised
+    provider/type columns and loading only the columns metric collection needs.
+    """
+    return (
+        db.query(Resource)
+        .filter(
+            Resource.monitoring_enabled.is_(True),
+            Resource.cloud_provider_norm == "aws",
+            Resource.resource_type_norm == "ec2",
+        )
+        .options(load_only(Resource.id, Resource.cloud_id, Resource.name))
+        .order_by(Resource.created_at.desc())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+
 # -------------------- Alert CRUD Operations --------------------
 
 def get_alert(db: Session, alert_id: UUID) -> Alert:
-    alert = db.query(Alert).filter(Alert.id == alert_id).first()
+    alert = get_by_id_cached(db, _alert_cache, Alert, alert_id)
+    if not alert:
+        logger.warning(f"Alert not found: {alert_id}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Alert not found."
+        )
+    return alert
+
+def get_alert_with_incident(db: Session, alert_id: UUID) -> Alert:
+    """
+    Retrieve an alert with its incident eagerly loaded in the same SELECT.
+    """
+    alert = db.get(Alert, alert_id, options=[joinedload(Alert.incident)])
     if not alert:
         logger.warning(f"Alert not found: {alert_id}")
         raise HTTPException(
@@ -129,7 +224,7 @@ def get_alerts(db: Session, skip: int = 0, limit: int = 100) -> List[Alert]:
 # -------------------- Incident CRUD Operations --------------------
 
 def get_incident(db: Session, incident_id: UUID) -> Incident:
-    incident = db.query(Incident).filter(Incident.id == incident_id).first()
+    incident = get_by_id_cached(db, _incident_cache, Incident, incident_id)
     if not incident:
         logger.warning(f"Incident not found: {incident_id}")
         raise HTTPException(
@@ -159,11 +254,72 @@ class ProductOut(BaseModel):
     id: UUID
     name: str
     description: Optional[str]
-    created_at: str
-    updated_at: str
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+# Read schemas for resources, alerts and incidents
+class ResourceOut(BaseModel):
+    id: UUID
+    product_id: UUID
+    name: str
+    cloud_id: str
+    cloud_provider: str
+    resource_type: str
+    # Read from the renamed ORM attribute but keep the public `metadata` key
+    resource_metadata: Optional[dict] = Field(None, serialization_alias="metadata")
+    monitoring_enabled: bool
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class AlertOut(BaseModel):
+    id: UUID
+    resource_id: Optional[UUID]
+    type: str
+    status: str
+    title: str
+    description: Optional[str]
+    triggered_at: datetime
+    resolved_at: Optional[datetime]
+    severity: str
+    details: Optional[dict]
+    incident_id: Optional[UUID]
+
+    class Config:
+        from_attributes = True
+
+class IncidentOut(BaseModel):
+    id: UUID
+    resource_id: Optional[UUID]
+    status: str
+    title: str
+    description: Optional[str]
+    opened_at: datetime
+    closed_at: Optional[datetime]
+    created_by: Optional[str]
 
     class Config:
-        orm_mode = True
+        from_attributes = True
+
+@functools.lru_cache(maxsize=None)
+def _schema_fields(schema) -> Tuple[Tuple[str, str], ...]:
+    """
+    Returns (attribute, output key) pairs for a schema's fields, honouring serialization aliases.
+    """
+    return tuple((name, field.serialization_alias or name) for name, field in schema.model_fields.items())
+
+def serialize_rows(rows, schema) -> List[dict]:
+    """
+    Converts trusted ORM rows into plain dicts holding `schema`'s fields, skipping
+    per-row Pydantic validation. Meant to be returned via ORJSONResponse.
+    """
+    fields = _schema_fields(schema)
+    return [{key: getattr(row, name) for name, key in fields} for row in rows]
 
 # Product Router
 def get_products_router() -> APIRouter:
@@ -196,16 +352,13 @@ def get_products_router() -> APIRouter:
 def get_resources_router() -> APIRouter:
     router = APIRouter()
 
-    @router.get("/", response_model=List[dict])
+    @router.get("/", response_model=List[ResourceOut])
     def list_resources(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-        resources = get_resources(db, skip=skip, limit=limit)
-        # Return as dicts for now; can define Pydantic schemas as needed
-        return [r.__dict__ for r in resources]
+        return get_resources(db, skip=skip, limit=limit)
 
-    @router.get("/{resource_id}", response_model=dict)
+    @router.get("/{resource_id}", response_model=ResourceOut)
     def get(resource_id: UUID, db: Session = Depends(get_db)):
-        resource = get_resource(db, resource_id)
-        return resource.__dict__
+        return get_resource(db, resource_id)
 
     return router
 
@@ -213,15 +366,13 @@ def get_resources_router() -> APIRouter:
 def get_alerts_router() -> APIRouter:
     router = APIRouter()
 
-    @router.get("/", response_model=List[dict])
+    @router.get("/", response_model=List[AlertOut])
     def list_alerts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-        alerts = get_alerts(db, skip=skip, limit=limit)
-        return [a.__dict__ for a in alerts]
+        return get_alerts(db, skip=skip, limit=limit)
 
-    @router.get("/{alert_id}", response_model=dict)
+    @router.get("/{alert_id}", response_model=AlertOut)
     def get(alert_id: UUID, db: Session = Depends(get_db)):
-        alert = get_alert(db, alert_id)
-        return alert.__dict__
+        return get_alert(db, alert_id)
 
     return router
 
@@ -229,21 +380,20 @@ def get_alerts_router() -> APIRouter:
 def get_incidents_router() -> APIRouter:
     router = APIRouter()
 
-    @router.get("/", response_model=List[dict])
+    @router.get("/", response_model=List[IncidentOut])
     def list_incidents(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-        incidents = get_incidents(db, skip=skip, limit=limit)
-        return [i.__dict__ for i in incidents]
+        return get_incidents(db, skip=skip, limit=limit)
 
-    @router.get("/{incident_id}", response_model=dict)
+    @router.get("/{incident_id}", response_model=IncidentOut)
     def get(incident_id: UUID, db: Session = Depends(get_db)):
-        incident = get_incident(db, incident_id)
-        return incident.__dict__
+        return get_incident(db, incident_id)
 
     return router
 
 # Exported symbols
 __all__ = [
     "get_db",
+    "get_by_id_cached",
     "create_product",
     "get_product",
     "get_products",
@@ -251,7 +401,11 @@ __all__ = [
     "delete_product",
     "get_resource",
     "get_resources",
+    "get_monitorable_aws_ec2_resources",
+    "invalidate_alert",
+    "invalidate_incident",
     "get_alert",
+    "get_alert_with_incident",
     "get_alerts",
     "get_incident",
     "get_incidents",
@@ -259,4 +413,8 @@ __all__ = [
     "get_resources_router",
     "get_alerts_router",
     "get_incidents_router",
+    "ResourceOut",
+    "AlertOut",
+    "IncidentOut",
+    "serialize_rows",
 ]
\ No newline at end of file
@@ -1,7 +1,8 @@
+import asyncio
 import logging
 import sys
 from fastapi import FastAPI, Request, status, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from sqlalchemy.exc import SQLAlchemyError
@@ -14,8 +15,8 @@ from crud import (
     get_alerts_router,
     get_incidents_router,
 )
-from monitoring import monitoring_router
-from alerting import alerting_router
+from monitoring import monitoring_router, warm_cloudwatch_client
+from alerting import alerting_router, close_smtp_pool, close_http_client
 from security_events import security_events_router
 from audit_log import audit_log_router
 
@@ -36,7 +37,8 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    default_response_class=ORJSONResponse,  # orjson encodes UUID/datetime natively
 )
 
 # CORS configuration (adjust origins as needed)
@@ -59,6 +61,18 @@ def on_startup():
         logger.error(f"Database initialization error: {e}")
         raise
 
+# Move the CloudWatch client's cold start (endpoint, credentials, TLS) out of the first request
+@app.on_event("startup")
+async def warm_clients():
+    await asyncio.to_thread(warm_cloudwatch_client)
+
+# Release pooled outbound connections
+@app.on_event("shutdown")
+async def on_shutdown():
+    logger.info("Shutting down Cloud Resource Monitoring & Alerting System API...")
+    await asyncio.to_thread(close_smtp_pool)  # one blocking QUIT per idle session
+    await close_http_client()
+
 # Exception handlers
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
@@ -1,32 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
+from db import get_db
 from models import (
-    SessionLocal,
     Resource,
     Alert,
     AlertStatus,
     AlertType,
 )
-from crud import get_resource, get_resources
+from crud import get_resource, get_monitorable_aws_ec2_resources
+from cache import TTLCache
 
 # For demonstration, we use boto3 for AWS CloudWatch integration.
 # In production, credentials and region should be securely managed.
 import boto3
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 
+# NumPy is optional; evaluate_metrics_batch falls back to plain Python without it
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the deployment image
+    np = None
+
 # Configure logger
 logger = logging.getLogger("monitoring")
 logger.setLevel(logging.INFO)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # Supported metrics for demonstration
 SUPPORTED_METRICS = ["CPUUtilization", "MemoryUtilization", "NetworkIn", "NetworkOut", "DiskReadBytes", "DiskWriteBytes"]
 
@@ -40,84 +50,313 @@ DEFAULT_THRESHOLDS = {
     "DiskWriteBytes": 1000000000,  # bytes
 }
 
+# Metric values travel as tuples aligned with SUPPORTED_METRICS; thresholds in the same order
+_THRESHOLDS_BY_INDEX = tuple(DEFAULT_THRESHOLDS[metric] for metric in SUPPORTED_METRICS)
+
+def _threshold_vector(limits: Sequence[Optional[float]]):
+    """Thresholds as a float64 array; metrics without one become nan, which never compares greater."""
+    return np.array([np.nan if limit is None else limit for limit in limits], dtype=np.float64)
+
+# Built once for the default metrics/thresholds used by every collection path
+_THRESH_VEC = _threshold_vector(_THRESHOLDS_BY_INDEX) if np is not None else None
+
+# CloudWatch query settings
+METRIC_NAMESPACE = "AWS/EC2"
+METRIC_PERIOD = 300  # seconds
+METRIC_STAT = "Average"
+METRIC_LOOKBACK = timedelta(minutes=10)  # Two periods, so the latest complete datapoint is always in range
+MAX_METRIC_QUERIES_PER_REQUEST = 500  # GetMetricData limit
+METRICS_FETCH_WORKERS = 16  # Max concurrent GetMetricData requests per bulk fetch
+
+# Fetched value tuples keyed by (cloud_id, metrics); the TTL stays well under METRIC_PERIOD
+_METRIC_CACHE = TTLCache(maxsize=10000, ttl=60)
+
 # --- CloudWatch Integration ---
 
+@functools.lru_cache(maxsize=8)
 def get_cloudwatch_client(region_name: str = "us-east-1"):
     """
-    Returns a boto3 CloudWatch client.
+    Returns a boto3 CloudWatch client, built once per region and reused afterwards.
     """
     try:
-        client = boto3.client("cloudwatch", region_name=region_name)
+        client = boto3.Session().client(
+            "cloudwatch",
+            region_name=region_name,
+            config=Config(
+                max_pool_connections=32,  # >= METRICS_FETCH_WORKERS so workers don't queue on the urllib3 pool
+                retries={"max_attempts": 3, "mode": "adaptive"},
+                connect_timeout=2,
+                read_timeout=10,
+                tcp_keepalive=True,  # Keep pooled connections alive between requests
+            ),
+        )
+        logger.info("Created CloudWatch client for region %s", region_name)
         return client
     except Exception as e:
-        logger.error(f"Failed to create CloudWatch client: {e}")
+        logger.error("Failed to create CloudWatch client: %s", e)
         raise
 
-def fetch_aws_metrics(resource: Resource, metrics: List[str]) -> Dict[str, Any]:
+def warm_cloudwatch_client(region_name: str = "us-east-1") -> bool:
+    """
+    Builds the cached client and makes one cheap call so endpoint resolution, credential
+    loading and the TLS handshake happen before the first real request. Never raises.
+    """
+    try:
+        get_cloudwatch_client(region_name).describe_alarms(MaxRecords=1)
+    except Exception as e:
+        # Startup must not fail on this; a denied call has still opened the pooled connection
+        logger.warning("CloudWatch client warm-up failed: %s", e)
+        return False
+    logger.info("CloudWatch client warmed for region %s", region_name)
+    return True
+
+def _build_metric_queries(cloud_id: str, metrics: List[str], prefix: str) -> List[Dict[str, Any]]:
+    """
+    Builds one GetMetricData query per metric for an EC2 instance, with Ids unique under `prefix`.
+    """
+    return [
+        {
+            "Id": f"{prefix}m{i}",
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": METRIC_NAMESPACE,
+                    "MetricName": metric,
+                    "Dimensions": [{"Name": "InstanceId", "Value": cloud_id}],
+                },
+                "Period": METRIC_PERIOD,
+                "Stat": METRIC_STAT,
+            },
+        }
+        for i, metric in enumerate(metrics)
+    ]
+
+def _metric_window() -> Tuple[datetime, datetime]:
+    """
+    Returns the (start, end) query window ending at the current minute.
     """
-    Fetches specified metrics for a given AWS resource from CloudWatch.
+    end = datetime.utcnow().replace(second=0, microsecond=0)
+    return end - METRIC_LOOKBACK, end
+
+def _get_metric_data(client, queries: List[Dict[str, Any]], start: datetime, end: datetime) -> Dict[str, Optional[float]]:
     """
+    Runs a single GetMetricData batch, following NextToken pages, and returns the newest value per query Id.
+    """
+    values: Dict[str, Optional[float]] = {query["Id"]: None for query in queries}
+    kwargs = {"MetricDataQueries": queries, "StartTime": start, "EndTime": end, "ScanBy": "TimestampDescending"}
+    while True:
+        response = client.get_metric_data(**kwargs)
+        for result in response.get("MetricDataResults", []):
+            # Results are ordered newest first, so keep the first value seen for each Id
+            if result.get("Values") and values.get(result["Id"]) is None:
+                values[result["Id"]] = result["Values"][0]
+        next_token = response.get("NextToken")
+        if not next_token:
+            return values
+        kwargs["NextToken"] = next_token
+
+def fetch_aws_metrics(
+    resource: Resource,
+    metrics: List[str],
+    force_refresh: bool = False,
+    window: Optional[Tuple[datetime, datetime]] = None,
+) -> Tuple[Optional[float], ...]:
+    """
+    Fetches specified metrics for a given AWS resource from CloudWatch in one GetMetricData call.
+    Returns the values as a tuple aligned with `metrics`, served from _METRIC_CACHE unless
+    force_refresh is set. `window` is the (start, end) range, computed now if omitted.
+    """
+    key = (resource.cloud_id, tuple(metrics))
+    if not force_refresh:
+        cached = _METRIC_CACHE.get(key)
+        if cached is not None:
+            return cached
+
     client = get_cloudwatch_client()
-    results = {}
-    for metric in metrics:
+    # For demonstration, assume EC2 instance
+    queries = _build_metric_queries(resource.cloud_id, metrics, prefix="r")
+    start, end = window or _metric_window()
+    try:
+        values = _get_metric_data(client, queries, start, end)
+    except (BotoCoreError, ClientError) as e:
+        logger.error("Error fetching metrics for resource %s: %s", resource.cloud_id, e)
+        return (None,) * len(metrics)
+    result = tuple(values[query["Id"]] for query in queries)
+    _METRIC_CACHE.set(key, result)
+    return result
+
+def _resources_per_request(metrics: List[str]) -> int:
+    """
+    Returns how many resources' queries fit into one GetMetricData call.
+    """
+    return max(1, MAX_METRIC_QUERIES_PER_REQUEST // max(1, len(metrics)))
+
+def fetch_aws_metrics_bulk(
+    resources: List[Resource],
+    metrics: List[str],
+    force_refresh: bool = False,
+    window: Optional[Tuple[datetime, datetime]] = None,
+    raise_errors: bool = False,
+) -> Dict[UUID, Tuple[Optional[float], ...]]:
+    """
+    Fetches metrics for many AWS resources, packing up to MAX_METRIC_QUERIES_PER_REQUEST
+    queries from different resources into each GetMetricData call and issuing the calls
+    concurrently on a bounded thread pool. Only resources missing from _METRIC_CACHE are
+    queried unless force_refresh is set. `window` is as for fetch_aws_metrics.
+    Returns a dict of resource id -> tuple of values aligned with `metrics`. Failed calls
+    yield all-None values, or re-raise the CloudWatch error if raise_errors is set.
+    """
+    metrics_key = tuple(metrics)
+    results: Dict[UUID, Tuple[Optional[float], ...]] = {}
+    to_fetch = []
+    for resource in resources:
+        cached = None if force_refresh else _METRIC_CACHE.get((resource.cloud_id, metrics_key))
+        if cached is not None:
+            results[resource.id] = cached
+        else:
+            to_fetch.append(resource)
+    if not to_fetch:
+        return results
+
+    client = get_cloudwatch_client()  # boto3 clients are thread-safe, so one is shared by all workers
+    start, end = window or _metric_window()
+    per_request = _resources_per_request(metrics)
+
+    # Read ORM attributes here, on the request thread; workers only see plain query dicts
+    batches = []
+    for offset in range(0, len(to_fetch), per_request):
+        queries_by_resource = [
+            (resource.id, resource.cloud_id, _build_metric_queries(resource.cloud_id, metrics, prefix=f"r{offset + i}"))
+            for i, resource in enumerate(to_fetch[offset:offset + per_request])
+        ]
+        batches.append(queries_by_resource)
+
+    def fetch_batch(queries_by_resource) -> Optional[Dict[str, Optional[float]]]:
+        queries = [query for _, _, resource_queries in queries_by_resource for query in resource_queries]
         try:
-            # For demonstration, assume EC2 instance
-            response = client.get_metric_statistics(
-                Namespace="AWS/EC2",
-                MetricName=metric,
-                Dimensions=[
-                    {"Name": "InstanceId", "Value": resource.cloud_id}
-                ],
-                StartTime=datetime.utcnow().replace(microsecond=0),
-                EndTime=datetime.utcnow().replace(microsecond=0),
-                Period=300,
-                Statistics=["Average"],
-            )
-            datapoints = response.get("Datapoints", [])
-            value = datapoints[-1]["Average"] if datapoints else None
-            results[metric] = value
+            return _get_metric_data(client, queries, start, end)
         except (BotoCoreError, ClientError) as e:
-            logger.error(f"Error fetching metric {metric} for resource {resource.cloud_id}: {e}")
-            results[metric] = None
+            logger.error("Error fetching metrics for %d resources: %s", len(queries_by_resource), e)
+            if raise_errors:
+                raise
+            return None
+
+    if len(batches) == 1:
+        batch_values = [fetch_batch(batches[0])]  # No pool needed (the streaming endpoint sends one batch per call)
+    else:
+        with ThreadPoolExecutor(max_workers=min(METRICS_FETCH_WORKERS, len(batches))) as executor:
+            batch_values = list(executor.map(fetch_batch, batches))
+
+    for queries_by_resource, values in zip(batches, batch_values):
+        for resource_id, cloud_id, resource_queries in queries_by_resource:
+            if values is None:
+                # Failed batches are not cached, so the next request retries them
+                results[resource_id] = (None,) * len(metrics)
+                continue
+            result = tuple(values.get(query["Id"]) for query in resource_queries)
+            _METRIC_CACHE.set((cloud_id, metrics_key), result)
+            results[resource_id] = result
     return results
 
 # --- Metric Evaluation ---
 
+def evaluate_metrics_batch(
+    rows: Sequence[Sequence[Optional[float]]],
+    metric_names: Sequence[str] = SUPPORTED_METRICS,
+    thresholds: Dict[str, float] = DEFAULT_THRESHOLDS,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Evaluates an N x M grid of values (one row per resource, columns aligned with
+    metric_names) against thresholds and returns the list of breaches for each row.
+    Missing values and metrics without a threshold never breach.
+    """
+    if not rows:
+        return []
+    default_limits = metric_names is SUPPORTED_METRICS and thresholds is DEFAULT_THRESHOLDS
+    if default_limits:
+        limits = _THRESHOLDS_BY_INDEX
+    else:
+        limits = tuple(thresholds.get(metric) for metric in metric_names)
+
+    if np is not None:
+        values = np.array(rows, dtype=np.float64)  # None -> nan
+        limit_vec = _THRESH_VEC if default_limits else _threshold_vector(limits)
+        mask = values > limit_vec  # comparisons against nan are False
+        # One nonzero() over the whole grid, then plain-Python ints/floats for building the dicts
+        row_idx, col_idx = np.nonzero(mask)
+        breaches: List[List[Dict[str, Any]]] = [[] for _ in range(len(rows))]
+        for i, j, value in zip(row_idx.tolist(), col_idx.tolist(), values[mask].tolist()):
+            breaches[i].append({"metric": metric_names[j], "value": value, "threshold": limits[j]})
+        return breaches
+
+    return [
+        [
+            {"metric": metric, "value": value, "threshold": limit}
+            for metric, value, limit in zip(metric_names, row, limits)
+            if limit is not None and value is not None and value > limit
+        ]
+        for row in rows
+    ]
+
 def evaluate_metrics(metrics: Dict[str, Any], thresholds: Dict[str, float]) -> List[Dict[str, Any]]:
     """
     Evaluates metrics against thresholds and returns a list of breaches.
     """
-    breaches = []
-    for metric, value in metrics.items():
-        threshold = thresholds.get(metric)
-        if threshold is not None and value is not None and value > threshold:
-            breaches.append({
-                "metric": metric,
-                "value": value,
-                "threshold": threshold,
-            })
-    return breaches
+    names = list(metrics)
+    return evaluate_metrics_batch([[metrics[name] for name in names]], names, thresholds)[0]
 
 # --- Monitoring Logic ---
 
-def collect_and_evaluate_metrics_for_resource(db: Session, resource: Resource) -> Dict[str, Any]:
+# Shared result for resources that are skipped; callers only read it
+_EMPTY_RESULT: Dict[str, Any] = {"metrics": {}, "breaches": []}
+
+def collect_and_evaluate_metrics_for_resource(
+    db: Session,
+    resource: Resource,
+    force_refresh: bool = False,
+    window: Optional[Tuple[datetime, datetime]] = None,
+) -> Dict[str, Any]:
     """
     Collects metrics for a resource and evaluates them against thresholds.
     Returns a dict with metrics and any breaches.
     """
-    if not resource.monitoring_enabled:
-        logger.info(f"Monitoring disabled for resource {resource.id}")
-        return {"metrics": {}, "breaches": []}
+    # For demonstration, only monitoring-enabled AWS EC2 is supported
+    if not (resource.monitoring_enabled and resource.cloud_provider_norm == "aws" and resource.resource_type_norm == "ec2"):
+        logger.info(
+            "Skipping metrics for resource %s (enabled=%s, provider/type=%s/%s)",
+            resource.id, resource.monitoring_enabled, resource.cloud_provider, resource.resource_type,
+        )
+        return _EMPTY_RESULT
 
-    # For demonstration, only AWS EC2 supported
-    if resource.cloud_provider.lower() == "aws" and resource.resource_type.lower() == "ec2":
-        metrics = fetch_aws_metrics(resource, SUPPORTED_METRICS)
-    else:
-        logger.warning(f"Monitoring not implemented for provider/type: {resource.cloud_provider}/{resource.resource_type}")
-        metrics = {}
+    values = fetch_aws_metrics(resource, SUPPORTED_METRICS, force_refresh=force_refresh, window=window)
+    breaches = evaluate_metrics_batch([values])[0]
+    return {"metrics": dict(zip(SUPPORTED_METRICS, values)), "breaches": breaches}
 
-    breaches = evaluate_metrics(metrics, DEFAULT_THRESHOLDS)
-    return {"metrics": metrics, "breaches": breaches}
+def collect_and_evaluate_metrics_for_resources(
+    db: Session,
+    resources: List[Resource],
+    force_refresh: bool = False,
+    window: Optional[Tuple[datetime, datetime]] = None,
+    raise_errors: bool = False,
+) -> Dict[UUID, Dict[str, Any]]:
+    """
+    Bulk variant of collect_and_evaluate_metrics_for_resource: all resources are queried
+    through batched GetMetricData calls. Resources must already be monitorable AWS EC2
+    instances (see crud.get_monitorable_aws_ec2_resources), so no per-row checks are made.
+    Returns a dict keyed by resource id. `raise_errors` is passed to fetch_aws_metrics_bulk.
+    """
+    if not resources:
+        return {}
+    values_by_resource = fetch_aws_metrics_bulk(
+        resources, SUPPORTED_METRICS, force_refresh=force_refresh, window=window, raise_errors=raise_errors
+    )
+    all_values = [values_by_resource[resource.id] for resource in resources]
+    # One vectorised comparison for the whole page instead of a loop per resource
+    all_breaches = evaluate_metrics_batch(all_values)
+    # Metric names are attached only here, for the response
+    return {
+        resource.id: {"metrics": dict(zip(SUPPORTED_METRICS, values)), "breaches": breaches}
+        for resource, values, breaches in zip(resources, all_values, all_breaches)
+    }
 
 # --- FastAPI Router ---
 
@@ -136,60 +375,137 @@ class ResourceMetricsOut(BaseModel):
 monitoring_router = APIRouter()
 
 @monitoring_router.get("/resources/{resource_id}/metrics", response_model=ResourceMetricsOut)
-def get_resource_metrics(
+async def get_resource_metrics(
     resource_id: UUID,
+    force_refresh: bool = Query(False, description="Bypass the metric cache and query CloudWatch"),
     db: Session = Depends(get_db)
 ):
     """
     Collect and evaluate metrics for a specific resource.
     """
-    resource = get_resource(db, resource_id)
-    result = collect_and_evaluate_metrics_for_resource(db, resource)
-    return ResourceMetricsOut(
-        resource_id=resource_id,
-        metrics=result["metrics"],
-        breaches=[
-            MetricResult(
-                metric=breach["metric"],
-                value=breach["value"],
-                threshold=breach["threshold"]
-            ) for breach in result["breaches"]
-        ]
-    )
+    # boto3 and the DB session are blocking; run them off the event loop
+    window = _metric_window()
+    resource = await asyncio.to_thread(get_resource, db, resource_id)
+    result = await asyncio.to_thread(collect_and_evaluate_metrics_for_resource, db, resource, force_refresh, window)
+    # Breaches already have the MetricResult shape, so bypass response_model re-validation
+    return ORJSONResponse({"resource_id": resource_id, "metrics": result["metrics"], "breaches": result["breaches"]})
 
 @monitoring_router.get("/resources/metrics", response_model=List[ResourceMetricsOut])
-def get_all_resources_metrics(
+async def get_all_resources_metrics(
+    request: Request,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    force_refresh: bool = Query(False, description="Bypass the metric cache and query CloudWatch"),
     db: Session = Depends(get_db)
 ):
     """
-    Collect and evaluate metrics for all resources.
+    Collect and evaluate metrics for all monitorable resources.
+    Results are streamed in completion order, as a JSON array or, for
+    `Accept: application/x-ndjson`, one object per line.
     """
-    resources = get_resources(db, skip=skip, limit=limit)
-    results = []
-    for resource in resources:
-        result = collect_and_evaluate_metrics_for_resource(db, resource)
-        results.append(ResourceMetricsOut(
-            resource_id=resource.id,
-            metrics=result["metrics"],
-            breaches=[
-                MetricResult(
-                    metric=breach["metric"],
-                    value=breach["value"],
-                    threshold=breach["threshold"]
-                ) for breach in result["breaches"]
+    window = _metric_window()  # One clock read shared by every batch in this request
+    resources = await asyncio.to_thread(get_monitorable_aws_ec2_resources, db, skip=skip, limit=limit)
+    ndjson = "application/x-ndjson" in request.headers.get("accept", "")
+    # Awaiting the first batch here lets setup failures (credentials, endpoint) surface as a
+    # regular HTTP error instead of a truncated 200 body.
+    body = await _start_resource_metrics_stream(db, resources, force_refresh, window, ndjson)
+    return StreamingResponse(body, media_type="application/x-ndjson" if ndjson else "application/json")
+
+def _metrics_error_entries(chunk: List[Resource]) -> List[Dict[str, Any]]:
+    """Placeholder entries for a batch whose collection failed after the response started."""
+    return [
+        {"resource_id": resource.id, "metrics": {}, "breaches": [], "error": "Metrics unavailable"}
+        for resource in chunk
+    ]
+
+async def _start_resource_metrics_stream(
+    db: Session,
+    resources: List[Resource],
+    force_refresh: bool,
+    window: Tuple[datetime, datetime],
+    ndjson: bool,
+) -> AsyncIterator[bytes]:
+    """
+    Schedules one GetMetricData batch of resources per task (at most METRICS_FETCH_WORKERS
+    concurrently) and waits for the first to finish. Raises if that batch failed; otherwise
+    returns an iterator yielding each batch's results as soon as it completes.
+    """
+    per_request = _resources_per_request(SUPPORTED_METRICS)
+    chunks = [resources[offset:offset + per_request] for offset in range(0, len(resources), per_request)]
+    semaphore = asyncio.Semaphore(METRICS_FETCH_WORKERS)
+
+    async def collect(chunk: List[Resource]):
+        try:
+            async with semaphore:
+                # raise_errors so CloudWatch failures (credentials, endpoint) reach the error handling below
+                collected = await asyncio.to_thread(
+                    collect_and_evaluate_metrics_for_resources, db, chunk, force_refresh, window, True
+                )
+            entries = [
+                {
+                    "resource_id": resource.id,
+                    "metrics": collected[resource.id]["metrics"],
+                    "breaches": collected[resource.id]["breaches"],
+                }
+                for resource in chunk
             ]
-        ))
-    return results
+            return chunk, entries, None
+        except Exception as e:
+            return chunk, None, e
+
+    tasks = [asyncio.ensure_future(collect(chunk)) for chunk in chunks]
+    completed = asyncio.as_completed(tasks)
+    first_batch = None
+    if tasks:
+        first_batch = await next(completed)
+        if first_batch[2] is not None:
+            for task in tasks:
+                task.cancel()
+            raise first_batch[2]
+    return _stream_resource_metrics(first_batch, completed, tasks, ndjson)
+
+async def _stream_resource_metrics(first_batch, completed, tasks, ndjson: bool) -> AsyncIterator[bytes]:
+    """
+    Encodes batches as they complete. A batch that fails mid-stream is reported as error
+    entries for its resources so the JSON array stays well-formed.
+    """
+    first = True
+    try:
+        if not ndjson:
+            yield b"["
+        batch = first_batch
+        while batch is not None:
+            chunk, entries, error = batch
+            if error is not None:
+                logger.error("Failed to collect metrics for %d resources: %s", len(chunk), error)
+                entries = _metrics_error_entries(chunk)
+            for entry in entries:
+                body = orjson.dumps(entry)
+                if ndjson:
+                    yield body + b"\n"
+                else:
+                    yield body if first else b"," + body
+                first = False
+            next_done = next(completed, None)
+            batch = await next_done if next_done is not None else None
+        if not ndjson:
+            yield b"]"
+    finally:
+        # Client disconnects close the generator early; don't leave batches running
+        for task in tasks:
+            task.cancel()
 
 # Exported symbols
 __all__ = [
     "monitoring_router",
     "collect_and_evaluate_metrics_for_resource",
+    "collect_and_evaluate_metrics_for_resources",
     "evaluate_metrics",
+    "evaluate_metrics_batch",
     "fetch_aws_metrics",
+    "fetch_aws_metrics_bulk",
     "get_cloudwatch_client",
+    "warm_cloudwatch_client",
     "SUPPORTED_METRICS",
     "DEFAULT_THRESHOLDS",
 ]
\ No newline at end of file
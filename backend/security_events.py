@@ -1,34 +1,28 @@
+import asyncio
 import logging
 from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+import orjson
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query, Response
 from sqlalchemy.orm import Session
 
+from db import SessionLocal, get_db
 from models import (
-    SessionLocal,
     Resource,
     Alert,
     AlertType,
     AlertStatus,
     AuditLog,
 )
-from crud import get_resource
-from alerting import deliver_alert, log_alert_event
+from crud import get_alert, get_resource
+from alerting import audit_event_fields, deliver_alert, log_alert_events_bulk
 
 # Configure logger
 logger = logging.getLogger("security_events")
 logger.setLevel(logging.INFO)
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # --- Security Event Detection Logic ---
 
 # Example: Supported security event types
@@ -39,49 +33,112 @@ SECURITY_EVENT_TYPES = [
     "privilege_escalation",
     "resource_exposure",
 ]
+SECURITY_EVENT_TYPES_SET = frozenset(SECURITY_EVENT_TYPES)
+
+# Static response body for /security-events/types, encoded once at import
+_TYPES_JSON = orjson.dumps(SECURITY_EVENT_TYPES)
+
+# Event types that raise a critical (rather than warning) alert
+_CRITICAL_EVENTS = frozenset({"unauthorized_access", "privilege_escalation", "resource_exposure"})
 
-def detect_security_event(
+async def _deliver_and_log_in_session(
     db: Session,
-    resource_id: UUID,
-    event_type: str,
+    alert: Alert,
+    actor: Optional[str],
+    details: Optional[dict],
+) -> bool:
+    """
+    Delivers a security alert and writes its delivery and detection audit rows in one commit.
+    """
+    audit_events: List[dict] = []
+    delivered = await deliver_alert(db, alert, audit_events=audit_events)
+    # The detection row shares the alert's timestamp, so both correlate exactly
+    audit_events.append(audit_event_fields(
+        alert, "security_event_detected", actor or "system", details or {}, event_time=alert.triggered_at,
+    ))
+    await asyncio.to_thread(log_alert_events_bulk, db, audit_events)
+    return delivered
+
+async def _deliver_and_log(
+    alert_id: UUID,
     actor: Optional[str] = None,
     details: Optional[dict] = None,
+    session_factory=SessionLocal,
+) -> bool:
+    """
+    Background task: reloads the alert in its own session (the request's session is
+    closed by then), delivers it and records the audit events.
+    """
+    db = session_factory()
+    try:
+        try:
+            alert = await asyncio.to_thread(get_alert, db, alert_id)  # Sync session, keep it off the loop
+        except HTTPException:
+            logger.warning("Security alert %s disappeared before background delivery.", alert_id)
+            return False
+        return await _deliver_and_log_in_session(db, alert, actor, details)
+    finally:
+        db.close()
+
+def _store_security_alert(
+    db: Session,
+    resource_id: UUID,
+    event_type: str,
+    details: Optional[dict],
+    now: Optional[datetime] = None,
 ) -> Alert:
     """
-    Detects and handles a security-relevant event for a resource.
-    Generates an alert, delivers it, and logs the event.
+    Inserts the alert for a security event (blocking DB work, run in a worker thread).
     """
-    if event_type not in SECURITY_EVENT_TYPES:
-        logger.warning(f"Unsupported security event type: {event_type}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Unsupported security event type: {event_type}"
-        )
     resource = get_resource(db, resource_id)
     alert = Alert(
         resource_id=resource.id,
-        type=AlertType.SECURITY,
-        status=AlertStatus.ACTIVE,
+        type=AlertType.SECURITY.value,
+        status=AlertStatus.ACTIVE.value,
         title=f"Security Event: {event_type.replace('_', ' ').title()}",
         description=f"Detected security event '{event_type}' on resource '{resource.name}'",
-        triggered_at=datetime.utcnow(),
-        severity="critical" if event_type in ["unauthorized_access", "privilege_escalation", "resource_exposure"] else "warning",
+        severity="critical" if event_type in _CRITICAL_EVENTS else "warning",
         details=details or {},
     )
+    if now is not None:
+        alert.triggered_at = now
+    # id and (unless given) triggered_at come from client-side column defaults, so the
+    # INSERT needs no RETURNING/refresh
     db.add(alert)
     db.commit()
-    db.refresh(alert)
-    logger.info(f"Security alert generated: {alert.id} for event {event_type} on resource {resource.id}")
+    logger.info("Security alert generated: %s for event %s on resource %s", alert.id, event_type, resource.id)
+    return alert
+
+async def detect_security_event(
+    db: Session,
+    resource_id: UUID,
+    event_type: str,
+    actor: Optional[str] = None,
+    details: Optional[dict] = None,
+    background: Optional[BackgroundTasks] = None,
+    now: Optional[datetime] = None,
+) -> Alert:
+    """
+    Detects and handles a security-relevant event for a resource.
+    Generates an alert, delivers it, and logs the event. When `background` is given,
+    delivery and audit logging are queued to run after the response is sent.
+    `now`, if given, is used as triggered_at so callers can stamp several alerts from one
+    request with the same time; otherwise the column default applies.
+    """
+    if event_type not in SECURITY_EVENT_TYPES_SET:
+        logger.warning("Unsupported security event type: %s", event_type)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported security event type: {event_type}"
+        )
+    # The session is synchronous; keep its round-trips off the event loop
+    alert = await asyncio.to_thread(_store_security_alert, db, resource_id, event_type, details, now)
 
     # Deliver alert via channels and log event
-    deliver_alert(db, alert)
-    log_alert_event(
-        db=db,
-        alert=alert,
-        event_type="security_event_detected",
-        actor=actor or "system",
-        details=details or {},
-    )
+    if background is not None:
+        background.add_task(_deliver_and_log, alert.id, actor, details)
+    else:
+        await _deliver_and_log_in_session(db, alert, actor, details)
     return alert
 
 # --- FastAPI Router ---
@@ -101,30 +158,33 @@ class SecurityAlertOut(BaseModel):
     status: str
     title: str
     description: Optional[str]
-    triggered_at: str
-    resolved_at: Optional[str]
+    triggered_at: datetime
+    resolved_at: Optional[datetime]
     severity: str
     details: Optional[dict]
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 security_events_router = APIRouter()
 
 @security_events_router.post("/security-events/detect", response_model=SecurityAlertOut, status_code=status.HTTP_201_CREATED)
-def detect_security_event_endpoint(
+async def detect_security_event_endpoint(
     event: SecurityEventIn,
+    background: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """
     Endpoint to detect and handle a security-relevant event for a resource.
+    The alert is returned once stored; delivery and audit logging run in the background.
     """
-    alert = detect_security_event(
+    alert = await detect_security_event(
         db=db,
         resource_id=event.resource_id,
         event_type=event.event_type,
         actor=event.actor,
         details=event.details,
+        background=background,
     )
     return alert
 
@@ -133,11 +193,12 @@ def list_security_event_types():
     """
     List supported security event types.
     """
-    return SECURITY_EVENT_TYPES
+    return Response(content=_TYPES_JSON, media_type="application/json")
 
 # Exported symbols
 __all__ = [
     "security_events_router",
     "detect_security_event",
     "SECURITY_EVENT_TYPES",
+    "SECURITY_EVENT_TYPES_SET",
 ]
\ No newline at end of file